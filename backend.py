@@ -9,9 +9,11 @@ except ImportError:
         raise ImportError("GE requires python2, 2.6 or higher, or 2.5 with simplejson.")
 
 import os
+import shutil
 import logging
 import urllib2
 import urlparse
+from json.decoder import scanstring
 
 
 class MetricsError(Exception):
@@ -29,27 +31,94 @@ class Backend(object):
         self.config = config
         self.logger = logger
 
-    def download_metrics_json(self):
-        response = urllib2.urlopen(self.config.graphite_url_metrics)
-        m = open('%s.tmp' % self.config.filename_metrics, 'w')
-        m.write(response.read())
-        m.close()
-        os.rename('%s.tmp' % self.config.filename_metrics, self.config.filename_metrics)
+    def download_metrics_json(self, chunk_size=64 * 1024):
+        '''
+        streams the metrics index from graphite to disk, chunk by chunk.
+        the ETag/Last-Modified of the previous download are sent along, so
+        an unchanged index is not transferred again, and an interrupted
+        download is resumed where it stopped (if graphite supports ranges).
+        returns whether a new metrics file was downloaded.
+        '''
+        filename_tmp = '%s.tmp' % self.config.filename_metrics
+        request = urllib2.Request(self.config.graphite_url_metrics)
+        if os.path.exists(self.config.filename_metrics):
+            validators = load_validators(self.config.filename_metrics)
+            if 'etag' in validators:
+                request.add_header('If-None-Match', validators['etag'])
+            if 'last-modified' in validators:
+                request.add_header('If-Modified-Since', validators['last-modified'])
+        offset = 0
+        if os.path.exists(filename_tmp):
+            validators = load_validators(filename_tmp)
+            validator = validators.get('etag', validators.get('last-modified'))
+            if validator:
+                offset = os.path.getsize(filename_tmp)
+                request.add_header('Range', 'bytes=%d-' % offset)
+                request.add_header('If-Range', validator)
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                return False
+            raise
+        try:
+            if response.getcode() == 206:
+                content_range = response.info().getheader('Content-Range', '')
+                if not content_range.startswith('bytes %d-' % offset):
+                    os.remove(filename_tmp)
+                    raise MetricsError("Can't resume metrics download", "unexpected Content-Range '%s'" % content_range)
+                m = open(filename_tmp, 'ab')
+            else:
+                m = open(filename_tmp, 'wb')
+                save_validators(filename_tmp, response.info())
+            length = 0
+            try:
+                while True:
+                    chunk = response.read(chunk_size)
+                    if not chunk:
+                        break
+                    m.write(chunk)
+                    length += len(chunk)
+            finally:
+                m.close()
+            # a connection that drops halfway just looks like the end of the data
+            expected_length = response.info().getheader('Content-Length')
+            if expected_length is not None and length != int(expected_length):
+                raise MetricsError("Incomplete metrics download", "got %d of %s bytes" % (length, expected_length))
+        finally:
+            response.close()
+        os.rename(filename_tmp, self.config.filename_metrics)
+        os.rename('%s.validators' % filename_tmp, '%s.validators' % self.config.filename_metrics)
+        return True
 
     def load_metrics(self):
+        return list(self.iter_metrics())
+
+    def iter_metrics(self, filename=None):
+        '''
+        yields the metric names from the metrics file one by one, without
+        ever loading the entire list in memory.
+        '''
+        if filename is None:
+            filename = self.config.filename_metrics
         try:
-            f = open(self.config.filename_metrics, 'r')
-            metrics = json.load(f)
-            # workaround for graphite bug where metrics can have leading dots
-            # has been fixed (https://github.com/graphite-project/graphite-web/pull/293)
-            # but older graphite versions still do it
-            if len(metrics) and metrics[0][0] == '.':
-                metrics = [m.lstrip('.') for m in metrics]
-            return metrics
+            f = open(filename, 'r')
+        except IOError, e:
+            raise MetricsError("Can't load metrics file", e)
+        try:
+            for metric in iter_json_strings(f):
+                # workaround for graphite bug where metrics can have leading dots
+                # has been fixed (https://github.com/graphite-project/graphite-web/pull/293)
+                # but older graphite versions still do it
+                if metric.startswith('.'):
+                    metric = metric.lstrip('.')
+                yield metric
         except IOError, e:
             raise MetricsError("Can't load metrics file", e)
         except ValueError, e:
             raise MetricsError("Can't parse metrics file", e)
+        finally:
+            f.close()
 
     def stat_metrics(self):
         try:
@@ -57,12 +126,113 @@ class Backend(object):
         except OSError, e:
             raise MetricsError("Can't load metrics file", e)
 
-    def update_data(self, s_metrics):
-        self.logger.debug("loading metrics")
-        metrics = self.load_metrics()
+    def update_data(self, s_metrics, delta=False):
+        '''
+        in delta mode, only the metrics that were added or removed since the
+        previous update are (un)indexed.  this requires that nothing else
+        changed, i.e. after modifying plugins you need a full update.
+        '''
+        # copy of the metrics file as it was when we last updated successfully
+        filename_indexed = '%s.indexed' % self.config.filename_metrics
+        if delta and os.path.exists(filename_indexed):
+            self.logger.debug("loading metrics and previously indexed metrics")
+            metrics = set(self.iter_metrics())
+            metrics_indexed = set(self.iter_metrics(filename_indexed))
+            metrics_added = metrics - metrics_indexed
+            metrics_removed = metrics_indexed - metrics
+            del metrics, metrics_indexed
+
+            self.logger.debug("updating targets (%d metrics added, %d removed)", len(metrics_added), len(metrics_removed))
+            s_metrics.update_targets(metrics_added, metrics_removed)
+        else:
+            if delta:
+                self.logger.warn("no previously indexed metrics found, doing a full update")
+            self.logger.debug("loading metrics")
+            metrics = self.iter_metrics()
+
+            self.logger.debug("updating targets")
+            s_metrics.update_targets(metrics)
+        shutil.copyfile(self.config.filename_metrics, '%s.tmp' % filename_indexed)
+        os.rename('%s.tmp' % filename_indexed, filename_indexed)
+
+
+def load_validators(filename):
+    '''
+    returns the http cache validators stored alongside the given file
+    '''
+    try:
+        f = open('%s.validators' % filename, 'r')
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+
+def save_validators(filename, headers):
+    validators = {}
+    for header in ('etag', 'last-modified'):
+        if headers.getheader(header):
+            validators[header] = headers.getheader(header)
+    f = open('%s.validators' % filename, 'w')
+    json.dump(validators, f)
+    f.close()
 
-        self.logger.debug("updating targets")
-        s_metrics.update_targets(metrics)
+
+def iter_json_strings(f, chunk_size=64 * 1024):
+    '''
+    incremental parser for a json list of strings, such as graphite's
+    metrics/index.json.  reads the file chunk by chunk and yields the strings
+    as soon as they are complete.
+    raises ValueError if the data is not a list of strings.
+    '''
+    buf = f.read(chunk_size)
+    pos = 0
+    eof = not buf
+    expect = '['  # one of '[', 'first' (string or ']'), 'string', 'separator'
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = f.read(chunk_size)
+            pos = 0
+            eof = not buf
+        if pos == len(buf):
+            raise ValueError("unexpected end of data")
+        c = buf[pos]
+        if expect == '[':
+            if c != '[':
+                raise ValueError("expected '[' at position %d" % pos)
+            pos += 1
+            expect = 'first'
+        elif c == ']' and expect in ('first', 'separator'):
+            return
+        elif expect == 'separator':
+            if c != ',':
+                raise ValueError("expected ',' or ']' at position %d" % pos)
+            pos += 1
+            expect = 'string'
+        else:
+            if c != '"':
+                raise ValueError("expected a string at position %d" % pos)
+            # the string may continue in the next chunk(s)
+            while True:
+                try:
+                    (string, end) = scanstring(buf, pos + 1)
+                    break
+                except ValueError:
+                    if eof:
+                        raise
+                    data = f.read(chunk_size)
+                    eof = not data
+                    buf = buf[pos:] + data
+                    pos = 0
+            yield string
+            pos = end
+            expect = 'separator'
 
 
 def get_action_on_rules_match(rules, subject):
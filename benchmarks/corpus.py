@@ -0,0 +1,144 @@
+#!/usr/bin/env python2
+"""
+Generates synthetic, but realistic, graphite metric namespaces, so we can
+benchmark without a production graphite.  The mix is roughly what you get
+from diamond, statsd (with histograms), carbon and openstack swift.
+"""
+import random
+
+cpu_states = ['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal', 'guest']
+memory_types = ['MemTotal', 'MemFree', 'Buffers', 'Cached', 'Active', 'Inactive', 'SwapTotal', 'SwapFree', 'SwapCached']
+iostat_types = ['reads', 'writes', 'reads_byte', 'writes_byte', 'io_milliseconds', 'average_queue_length',
+                'await', 'util_percentage', 'reads_per_second', 'writes_per_second']
+diskspace_types = ['byte_used', 'byte_free', 'byte_avail', 'inodes_used', 'inodes_free']
+network_types = ['rx_byte', 'tx_byte', 'rx_packets', 'tx_packets', 'rx_errors', 'tx_errors']
+diamond_collectors = ['cpu', 'memory', 'iostat', 'diskspace', 'network', 'loadavg']
+timer_types = ['count', 'lower', 'mean', 'mean_90', 'std', 'sum', 'sum_90', 'upper', 'upper_90']
+timer_bins = ['bin_10', 'bin_50', 'bin_100', 'bin_500', 'bin_1000', 'bin_inf']
+carbon_types = ['avgUpdateTime', 'committedPoints', 'cpuUsage', 'creates', 'errors', 'memUsage',
+                'metricsReceived', 'pointsPerUpdate', 'updateOperations', 'cache.size', 'cache.queues']
+swift_types = ['account', 'container', 'object']
+swift_methods = ['GET', 'HEAD', 'PUT', 'DELETE']
+swift_codes = ['200', '201', '204', '404', '503']
+app_words = ['api', 'web', 'auth', 'search', 'billing', 'upload', 'render', 'queue', 'cache', 'feed']
+
+
+def diamond_server(i, rnd):
+    prefix = 'servers.host%d' % i
+    for core in ['total'] + ['cpu%d' % c for c in range(rnd.choice([2, 4, 8]))]:
+        for state in cpu_states:
+            yield '%s.cpu.%s.%s' % (prefix, core, state)
+    for t in memory_types:
+        yield '%s.memory.%s' % (prefix, t)
+    for t in ['01', '05', '15', 'processes_running', 'processes_total']:
+        yield '%s.loadavg.%s' % (prefix, t)
+    for device in ['sda', 'sdb', 'dm-0'][:rnd.randint(1, 3)]:
+        for t in iostat_types:
+            yield '%s.iostat.%s.%s' % (prefix, device, t)
+    for mountpoint in ['root', '_srv', '_var_log'][:rnd.randint(1, 3)]:
+        for t in diskspace_types:
+            yield '%s.diskspace.%s.%s' % (prefix, mountpoint, t)
+    for device in ['eth0', 'eth1', 'lo'][:rnd.randint(1, 3)]:
+        for t in network_types:
+            yield '%s.network.%s.%s' % (prefix, device, t)
+    for t in ['InDatagrams', 'OutDatagrams', 'InErrors', 'RcvbufErrors', 'NoPorts']:
+        yield '%s.udp.%s' % (prefix, t)
+    for t in ['ActiveOpens', 'PassiveOpens', 'RetransSegs', 'TCPTimeouts']:
+        yield '%s.tcp.%s' % (prefix, t)
+    for t in ['pgpgin', 'pgpgout', 'pswpin', 'pswpout']:
+        yield '%s.vmstat.%s' % (prefix, t)
+    for t in ['used', 'tcp_inuse', 'tcp_orphan', 'udp_inuse']:
+        yield '%s.sockets.%s' % (prefix, t)
+    for t in ['assigned', 'max', 'unused']:
+        yield '%s.files.%s' % (prefix, t)
+    for collector in diamond_collectors:
+        yield '%s.%s.collector_time_ms' % (prefix, collector)
+    # something no specific plugin knows about
+    yield '%s.userscripts.job%d.duration' % (prefix, rnd.randint(0, 9))
+
+
+def statsd_timer(i, rnd):
+    name = '%s.%s%d' % (rnd.choice(app_words), rnd.choice(app_words), i)
+    for t in timer_types:
+        yield 'stats.timers.%s.%s' % (name, t)
+    if rnd.random() < 0.5:
+        for b in timer_bins:
+            yield 'stats.timers.%s.%s' % (name, b)
+
+
+def statsd_counter(i, rnd):
+    name = '%s.%s%d' % (rnd.choice(app_words), rnd.choice(app_words), i)
+    yield 'stats.%s' % name
+    yield 'stats_counts.%s' % name
+    if rnd.random() < 0.3:
+        yield 'stats.gauges.%s' % name
+
+
+def swift_server(i, rnd):
+    server = 'proxy%d' % i
+    for swift_type in swift_types:
+        for method in swift_methods:
+            for code in rnd.sample(swift_codes, 2):
+                for t in ['mean', 'upper_90', 'count']:
+                    yield 'stats.timers.%s.proxy-server.%s.%s.%s.timing.%s' % (server, swift_type, method, code, t)
+                yield 'stats_counts.%s.proxy-server.%s.%s.%s.xfer' % (server, swift_type, method, code)
+                yield 'stats.%s.proxy-server.%s.%s.%s.xfer' % (server, swift_type, method, code)
+    for t in ['errors', 'client_timeouts', 'client_disconnects', 'handoff_count']:
+        yield 'stats_counts.%s.proxy-server.%s' % (server, t)
+    for t in ['async_pendings', 'errors', 'timeouts']:
+        yield 'stats_counts.%s.object-server.%s' % (server, t)
+        yield 'stats.%s.object-server.%s' % (server, t)
+    for method in swift_methods:
+        yield 'stats.timers.%s.object-server.%s.timing.mean' % (server, method)
+    for t in ['token_denied', 'errors']:
+        yield 'stats.%s.tempauth.AUTH_.%s' % (server, t)
+        yield 'stats_counts.%s.tempauth.AUTH_.%s' % (server, t)
+
+
+def carbon_agent(i, rnd):
+    for t in carbon_types:
+        yield 'carbon.agents.graphite%d-a.%s' % (i, t)
+
+
+def other(i, rnd):
+    yield 'misc%d.%s.%s' % (i % 50, rnd.choice(app_words), i)
+
+
+# (generator, relative weight): how often an entity of every kind is created
+families = [
+    (diamond_server, 2),
+    (statsd_timer, 40),
+    (statsd_counter, 40),
+    (swift_server, 1),
+    (carbon_agent, 1),
+    (other, 16),
+]
+
+
+def generate_metrics(count, seed=0):
+    '''
+    yields count unique metric names (deterministic for a given seed)
+    '''
+    rnd = random.Random(seed)
+    weights_total = sum(weight for (family, weight) in families)
+    entities = dict((family, 0) for (family, weight) in families)
+    yielded = 0
+    # statsd itself is always there
+    for metric in ['stats.statsd.numStats', 'stats.statsd.processing_time', 'stats.statsd.packets_received',
+                   'stats.statsd.bad_lines_seen', 'stats.statsd.graphiteStats.last_flush']:
+        if yielded == count:
+            return
+        yield metric
+        yielded += 1
+    while True:
+        pick = rnd.uniform(0, weights_total)
+        for (family, weight) in families:
+            pick -= weight
+            if pick <= 0:
+                break
+        for metric in family(entities[family], rnd):
+            if yielded == count:
+                return
+            yield metric
+            yielded += 1
+        entities[family] += 1
@@ -0,0 +1,73 @@
+#!/usr/bin/env python2
+"""
+Benchmark of StructuredMetrics.list_targets on synthetic metric namespaces.
+every size runs in its own process, so that the peak memory is its own.
+"""
+import os
+import sys
+import time
+import resource
+import subprocess
+from optparse import OptionParser
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(root)
+sys.path.insert(0, root)
+
+import config
+import structured_metrics
+from benchmarks.corpus import generate_metrics
+
+
+def run(count, seed, profile):
+    s_metrics = structured_metrics.StructuredMetrics(config)
+    errors = s_metrics.load_plugins()
+    if errors:
+        for e in errors:
+            print '\t%s' % e
+        sys.exit(2)
+    s_metrics.profiling = profile
+
+    start = time.time()
+    for metric in generate_metrics(count, seed):
+        pass
+    time_generate = time.time() - start
+
+    # the plugins print warnings for some metrics, we don't care
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    start = time.time()
+    targets = s_metrics.list_targets(generate_metrics(count, seed))
+    time_list = time.time() - start - time_generate
+    sys.stdout = stdout
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print '%10d %10d %10.2f %12d %12.1f' % (count, len(targets), time_list, count / max(time_list, 0.001), peak_rss)
+    if profile:
+        print s_metrics.get_profile_report()
+
+
+parser = OptionParser(usage="%prog [options]")
+parser.add_option('--metrics', default='1000,10000,100000',
+                  help="comma separated list of corpus sizes (number of metrics) [default: %default]")
+parser.add_option('--seed', type='int', default=0, help="seed for the corpus generator [default: %default]")
+parser.add_option('--processes', type='int', default=1,
+                  help="number of processes to classify metrics with (config.update_processes) [default: %default]")
+parser.add_option('--cache', action='store_true', default=False,
+                  help="use the classification cache (config.filename_classification_cache), run twice to see the effect")
+parser.add_option('--profile', action='store_true', default=False, help="print a profile report for every size")
+(options, args) = parser.parse_args()
+
+config.update_processes = options.processes
+if not options.cache:
+    config.filename_classification_cache = None
+
+sizes = [int(size) for size in options.metrics.split(',')]
+if len(sizes) == 1:
+    run(sizes[0], options.seed, options.profile)
+else:
+    print '%10s %10s %10s %12s %12s' % ('metrics', 'targets', 'time (s)', 'metrics/s', 'peak RSS MB')
+    sys.stdout.flush()
+    for size in sizes:
+        argv = [sys.executable, os.path.abspath(__file__), '--metrics', str(size)] + sys.argv[1:]
+        subprocess.check_call(argv)
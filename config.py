@@ -6,6 +6,8 @@ filename_metrics = 'metrics.json'
 log_file = 'graph-explorer.log'
 es_host = "es_host"
 es_port = 9200
+update_processes = 1  # update_metrics.py can classify metrics using multiple processes
+filename_classification_cache = 'classification_cache.db'  # set to None to always classify all metrics
 
 # Don't edit after this line
 import urlparse
@@ -1,8 +1,15 @@
 import os
 import re
 import sys
+import time
+import hashlib
+import inspect
+from collections import deque
 from inspect import isclass
+from itertools import islice
+import multiprocessing
 import sre_constants
+import sre_parse
 try:
     import json
 except ImportError:
@@ -15,6 +22,7 @@ sys.path.append("%s/structured_metrics/%s" % (os.getcwd(), 'rawes'))
 
 import rawes
 import requests
+from classification_cache import ClassificationCache
 
 
 query_all = {
@@ -61,7 +69,15 @@ class PluginError(Exception):
 class StructuredMetrics(object):
 
     def __init__(self, config):
+        self.config = config
         self.plugins = []
+        # for every plugin (index) the literal prefixes of its target configs
+        self.dispatch_index = []
+        # cache of plugins/target configs to try, per metric dispatch key
+        self.dispatch_plans = {}
+        # collect statistics in list_targets, see get_profile_report
+        self.profiling = False
+        self.profile = None
         self.es = rawes.Elastic("%s:%s" % (config.es_host, config.es_port))
 
     def load_plugins(self):
@@ -101,19 +117,70 @@ class StructuredMetrics(object):
         os.chdir(wd)
         # sort plugins by their matching priority
         self.plugins = sorted(self.plugins, key=lambda t: t[1].priority, reverse=True)
+        self.build_dispatch_index()
         return errors
 
+    def build_dispatch_index(self):
+        '''
+        most match regexes start with a literal (i.e. '^servers\.' or
+        '^stats\.timers'), so for a given metric we know in advance which
+        target configs can't possibly match.
+        note that we only look at the first 2 nodes of a prefix, so that
+        metrics can be dispatched by their first 2 nodes (see get_dispatch_plan)
+        '''
+        self.dispatch_index = []
+        self.dispatch_plans = {}
+        for (i, plugin) in enumerate(self.plugins):
+            (plugin_name, plugin_object) = plugin
+            target_prefixes = []
+            for (id, target) in enumerate(plugin_object.targets):
+                prefixes = []
+                for match_object in target['match_object']:
+                    prefix = regex_literal_prefix(match_object)
+                    if prefix is None:
+                        prefixes = None
+                        break
+                    prefixes.append('.'.join(prefix.split('.', 2)[:2]))
+                if prefixes is not None:
+                    prefixes = tuple(prefixes)
+                target_prefixes.append((id, prefixes))
+            self.dispatch_index.append((i, target_prefixes))
+
+    def get_dispatch_plan(self, metric):
+        '''
+        returns a list of (plugin index, target config ids) of all target
+        configs that can match the metric (those with a literal prefix that
+        is compatible with the metric, or no prefix at all)
+        '''
+        key = '.'.join(metric.split('.', 2)[:2])
+        try:
+            return self.dispatch_plans[key]
+        except KeyError:
+            plan = []
+            for (i, target_prefixes) in self.dispatch_index:
+                target_ids = [id for (id, prefixes) in target_prefixes if prefixes is None or key.startswith(prefixes)]
+                if target_ids:
+                    plan.append((i, target_ids))
+            self.dispatch_plans[key] = plan
+            return plan
+
     def list_targets(self, metrics):
         for plugin in self.plugins:
             (plugin_name, plugin_object) = plugin
             plugin_object.reset_target_yield_counters()
+            if self.profiling:
+                plugin_object.reset_profile()
+        start = time.time()
+        metrics_count = 0
         targets = {}
-        for metric in metrics:
-            metric_matched = False
-            for (i, plugin) in enumerate(self.plugins):
-                (plugin_name, plugin_object) = plugin
-                for (k, v) in plugin_object.find_targets(metric):
-                    metric_matched = True
+        for candidates in self.classify_metrics(metrics):
+            metrics_count += 1
+            # for every plugin, the first candidate it can yield wins.
+            for (i, plugin_candidates) in candidates:
+                (plugin_name, plugin_object) = self.plugins[i]
+                for (id, (k, v)) in plugin_candidates:
+                    if not plugin_object.take_target_candidate(id):
+                        continue
                     tags = v['tags']
                     if ('what' not in tags or 'target_type' not in tags) and 'unit' not in tags:
                         print "WARNING: metric", v, "doesn't have the mandatory tags. ignoring it..."
@@ -130,17 +197,139 @@ class StructuredMetrics(object):
                                 'bits': 'b'
                             }
                             unit = convert.get(tags['what'], tags['what'])
-                            if tags['target_type'] is 'rate':
+                            if tags['target_type'] == 'rate':
                                 v['tags']['unit'] = '%s/s' % unit
                             else:
                                 v['tags']['unit'] = unit
                         targets[k] = v
-                    if metric_matched:
-                        break
+                    break
+        if self.profiling:
+            self.profile = {'metrics': metrics_count, 'targets': len(targets), 'time': time.time() - start}
         return targets
 
+    def get_profile_report(self):
+        '''
+        report of the statistics collected by the last list_targets call,
+        per plugin and per target config, sorted by time spent.
+        note that with multiple processes, time is the sum of all processes.
+        '''
+        if self.profile is None:
+            return 'no profile collected. enable profiling before calling list_targets'
+        columns = ('time', 'attempts', 'matches', 'no_match', 'yields')
+        line = '%10.3f %10d %10d %10d %10d  %s'
+        header = '%10s %10s %10s %10s %10s  %s'
+        plugins_stats = []
+        targets_stats = []
+        for (plugin_name, plugin_object) in self.plugins:
+            plugin_stats = dict((key, 0) for key in columns)
+            for (id, stats) in enumerate(plugin_object.profile):
+                for key in columns:
+                    plugin_stats[key] += stats[key]
+                regexes = ' '.join(match_object.pattern for match_object in plugin_object.targets[id]['match_object'])
+                targets_stats.append((stats, '%s[%d] %s' % (plugin_name, id, regexes)))
+            plugins_stats.append((plugin_stats, plugin_name))
+        total = self.profile['time']
+        report = ['list_targets: %d metrics -> %d targets in %.3fs (%d metrics/s)' % (
+            self.profile['metrics'], self.profile['targets'], total, self.profile['metrics'] / max(total, 0.001))]
+        for (title, rows) in (('per plugin:', plugins_stats), ('per target config:', targets_stats)):
+            report.append('')
+            report.append(title)
+            report.append(header % (columns + ('',)))
+            for (stats, name) in sorted(rows, key=lambda row: row[0]['time'], reverse=True):
+                report.append(line % (tuple(stats[key] for key in columns) + (name,)))
+        return '\n'.join(report)
+
+    def classify_metric(self, metric):
+        '''
+        returns a list of (plugin index, target candidates) for all plugins
+        that have target candidates for the metric, in priority order.
+        the outcome only depends on the metric (see Plugin.find_target_candidates)
+        '''
+        candidates = []
+        for (i, target_ids) in self.get_dispatch_plan(metric):
+            (plugin_name, plugin_object) = self.plugins[i]
+            plugin_candidates = list(plugin_object.find_target_candidates(metric, target_ids))
+            if plugin_candidates:
+                candidates.append((i, plugin_candidates))
+        return candidates
+
+    def classify_metrics(self, metrics, chunk_size=1000):
+        '''
+        like imap(self.classify_metric, metrics), but metrics found in the
+        classification cache are not classified again, and the others can be
+        sharded across a pool of worker processes (which each load the
+        plugins once). results are yielded in the same order as the metrics.
+        '''
+        processes = self.config.update_processes
+        pool = None
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, _classify_worker_init, (self.config, self.profiling))
+        cache = None
+        # when profiling, we want to know the cost of classifying everything
+        if self.config.filename_classification_cache and not self.profiling:
+            cache = ClassificationCache(self.config.filename_classification_cache, self.get_plugins_fingerprint())
+        try:
+            # bounded amount of chunks in flight, so we don't need all
+            # metrics (or all results) in memory at once.
+            pending = deque()
+            metrics = iter(metrics)
+            while True:
+                chunk = list(islice(metrics, chunk_size))
+                if chunk:
+                    cached = {}
+                    if cache is not None:
+                        cached = cache.get_many(chunk)
+                    misses = [metric for metric in chunk if metric not in cached]
+                    if pool is not None:
+                        classified = pool.apply_async(_classify_worker, (misses,))
+                    else:
+                        classified = map(self.classify_metric, misses)
+                    pending.append((chunk, cached, misses, classified))
+                if pending and (pool is None or len(pending) >= processes * 2 or not chunk):
+                    (chunk_done, cached, misses, classified) = pending.popleft()
+                    if pool is not None:
+                        (classified, profiles) = classified.get()
+                        if profiles is not None:
+                            for ((plugin_name, plugin_object), profile) in zip(self.plugins, profiles):
+                                plugin_object.merge_profile(profile)
+                    classified = dict(zip(misses, classified))
+                    if cache is not None:
+                        cache.put_many(classified.iteritems())
+                    for metric in chunk_done:
+                        if metric in cached:
+                            yield cached[metric]
+                        else:
+                            yield classified[metric]
+                elif not chunk:
+                    break
+            if pool is not None:
+                pool.close()
+                pool.join()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if cache is not None:
+                cache.close()
+
+    def get_plugins_fingerprint(self):
+        '''
+        a hash covering everything that influences how metrics are
+        classified: the base plugin class, and all plugins (source and
+        priority) in the order they are used
+        '''
+        import plugins
+        fingerprint = hashlib.sha1(inspect.getsource(plugins))
+        for (plugin_name, plugin_object) in self.plugins:
+            plugin_class = plugin_object.__class__
+            fingerprint.update('\0%s.%s\0%s\0' % (plugin_name, plugin_class.__name__, plugin_object.priority))
+            fingerprint.update(inspect.getsource(sys.modules[plugin_class.__module__]))
+        return fingerprint.hexdigest()
 
-    def update_targets(self, metrics):
+    def update_targets(self, metrics, deleted_metrics=()):
+        '''
+        index the targets for the given metrics, and remove the targets of
+        the deleted metrics
+        '''
         # using >1 threads/workers/connections would make this faster
 
         bulk_size = 1000
@@ -166,8 +355,18 @@ class StructuredMetrics(object):
             if len(bulk_list) >= bulk_size:
                 flush(bulk_list)
                 bulk_list = []
+        for metric in deleted_metrics:
+            bulk_list.append({'delete': {'_id': metric}})
+            if len(bulk_list) >= bulk_size:
+                flush(bulk_list)
+                bulk_list = []
         flush(bulk_list)
 
+        if deleted_metrics and self.config.filename_classification_cache:
+            cache = ClassificationCache(self.config.filename_classification_cache, self.get_plugins_fingerprint())
+            cache.delete_many(deleted_metrics)
+            cache.close()
+
     def load_metric(self, metric_id):
         hit = self.get(metric_id)
         return hit_to_metric(hit)
@@ -280,6 +479,52 @@ class StructuredMetrics(object):
         return results
 
 
+# each list_targets worker process has its own StructuredMetrics
+_classify_worker_s_metrics = None
+
+
+def _classify_worker_init(config, profiling):
+    global _classify_worker_s_metrics
+    _classify_worker_s_metrics = StructuredMetrics(config)
+    _classify_worker_s_metrics.load_plugins()
+    _classify_worker_s_metrics.profiling = profiling
+
+
+def _classify_worker(metrics):
+    '''
+    returns the classification of the metrics, and if profiling, the
+    statistics of every plugin for this batch
+    '''
+    s_metrics = _classify_worker_s_metrics
+    profiles = None
+    if s_metrics.profiling:
+        for (plugin_name, plugin_object) in s_metrics.plugins:
+            plugin_object.reset_profile()
+    classified = map(s_metrics.classify_metric, metrics)
+    if s_metrics.profiling:
+        profiles = [plugin_object.profile for (plugin_name, plugin_object) in s_metrics.plugins]
+    return (classified, profiles)
+
+
+def regex_literal_prefix(regex):
+    '''
+    returns the literal string that all matches of the (compiled) regex must
+    start with, or None if the regex is not anchored at the beginning.
+    '''
+    if regex.flags & (re.IGNORECASE | re.MULTILINE):
+        return None
+    items = list(sre_parse.parse(regex.pattern, regex.flags))
+    if not items or items[0] not in ((sre_constants.AT, sre_constants.AT_BEGINNING),
+                                     (sre_constants.AT, sre_constants.AT_BEGINNING_STRING)):
+        return None
+    prefix = []
+    for (op, av) in items[1:]:
+        if op != sre_constants.LITERAL or av > 127:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+
 def parse_patterns(query, graph=False):
     # prepare higher performing query structure
     # note that if you have twice the exact same "word" (ignoring leading '!'), the last one wins
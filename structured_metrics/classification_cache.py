@@ -0,0 +1,48 @@
+import cPickle as pickle
+import sqlite3
+
+
+class ClassificationCache(object):
+    '''
+    on-disk cache of the outcome of StructuredMetrics.classify_metric per
+    metric.  the outcome depends on the plugins, so the cache is tied to a
+    fingerprint of the plugins, and gets cleared when that changes.
+    '''
+
+    def __init__(self, filename, fingerprint):
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self.db.execute('DROP TABLE IF EXISTS classifications')
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        self.db.execute('CREATE TABLE IF NOT EXISTS classifications (metric TEXT PRIMARY KEY, candidates BLOB)')
+        self.db.commit()
+
+    def get_many(self, metrics, batch_size=500):
+        '''
+        returns a dict with the cached outcome for those metrics we have
+        '''
+        found = {}
+        metrics = list(metrics)
+        # stay below sqlite's limit of 999 variables per statement
+        for i in range(0, len(metrics), batch_size):
+            batch = metrics[i:i + batch_size]
+            query = 'SELECT metric, candidates FROM classifications WHERE metric IN (%s)' % ','.join('?' * len(batch))
+            for (metric, candidates) in self.db.execute(query, batch):
+                found[metric] = pickle.loads(str(candidates))
+        return found
+
+    def put_many(self, items):
+        self.db.executemany('INSERT OR REPLACE INTO classifications VALUES (?, ?)',
+                            ((metric, sqlite3.Binary(pickle.dumps(candidates, pickle.HIGHEST_PROTOCOL)))
+                             for (metric, candidates) in items))
+
+    def delete_many(self, metrics):
+        self.db.executemany('DELETE FROM classifications WHERE metric = ?', ((metric,) for metric in metrics))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+# vim: ts=4 et sw=4:
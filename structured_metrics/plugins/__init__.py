@@ -1,5 +1,6 @@
 #!/usr/bin/env python2
 import re
+import time
 """
 Base Plugin class
 """
@@ -83,12 +84,28 @@ class Plugin(object):
 
     def __init__(self):
         self.targets = self.get_targets()
+        # per target config statistics, if enabled (see reset_profile)
+        self.profile = None
 
     # track how many times targets have been yielded, for limit setting
     def reset_target_yield_counters(self):
         for (id, target) in enumerate(self.targets):
             self.targets[id]['yielded'] = 0
 
+    def reset_profile(self):
+        '''
+        (re)start collecting statistics for every target config: time spent
+        matching, regexes tried, matches, no_match rejections and yields
+        '''
+        self.profile = []
+        for target in self.targets:
+            self.profile.append({'time': 0.0, 'attempts': 0, 'matches': 0, 'no_match': 0, 'yields': 0})
+
+    def merge_profile(self, profile):
+        for (stats, other_stats) in zip(self.profile, profile):
+            for key in stats:
+                stats[key] += other_stats[key]
+
     def get_target_id(self, target):
         target_key = ['targets']
         for tag_key in sorted(target['tags'].iterkeys()):  # including the tag key allows to filter out all http things by just writing 'http'
@@ -143,27 +160,85 @@ class Plugin(object):
         for (id, target) in enumerate(self.targets):
             if 'limit' in target and target['limit'] == target['yielded']:
                 continue
-            # metric must not match any of the no_match objects
-            yield_metric = True
-            for no_match_object in target.get('no_match_object', []):
-                no_match = no_match_object.search(metric)
-                if no_match is not None:
-                    yield_metric = False
-                    break
-            if not yield_metric:
-                continue
-            # any match object that creates a match is a winner, yield it
-            for match_object in target['match_object']:
-                match = match_object.search(metric)
-                if match is not None:
-                    target = self.__create_target(match, target)
-                    target = self.__sanitize_target(target)
-                    target = self.__configure_target(target)
-                    del target['config']  # not needed beyond this point
-                    self.targets_found += 1
-                    self.targets[id]['yielded'] += 1
-                    yield (self.get_target_id(target), target)
-                    continue
+            target = self.__profile_match_target(id, metric, target)
+            if target is not None:
+                self.targets_found += 1
+                self.targets[id]['yielded'] += 1
+                if self.profile is not None:
+                    self.profile[id]['yields'] += 1
+                yield (self.get_target_id(target), target)
+
+    def find_target_candidates(self, metric, target_ids=None):
+        """
+        Like find_targets, but ignoring limits, so that the result only
+        depends on the metric (and can be computed anywhere, in any order).
+        yields tuples of the target config id and the (id, target) tuple, up
+        to and including the first target config that has no limit.
+        whoever uses the candidates should call take_target_candidate for
+        them in order, the first one that is accepted is the one to use.
+        target_ids optionally restricts the target configs to try, (in
+        ascending order) i.e. to skip the ones that can't match anyway.
+        """
+        if target_ids is None:
+            target_ids = xrange(len(self.targets))
+        for id in target_ids:
+            target = self.targets[id]
+            target_found = self.__profile_match_target(id, metric, target)
+            if target_found is not None:
+                yield (id, (self.get_target_id(target_found), target_found))
+                if 'limit' not in target:
+                    return
+
+    def take_target_candidate(self, id):
+        '''
+        returns whether a candidate from target config id can be used,
+        given the limit of that target config, and counts it if so.
+        '''
+        target = self.targets[id]
+        if 'limit' in target and target['limit'] == target['yielded']:
+            return False
+        self.targets_found += 1
+        target['yielded'] += 1
+        if self.profile is not None:
+            self.profile[id]['yields'] += 1
+        return True
+
+    def __profile_match_target(self, id, metric, target):
+        if self.profile is None:
+            return self.__match_target(metric, target)
+        start = time.time()
+        target = self.__match_target(metric, target, self.profile[id])
+        self.profile[id]['time'] += time.time() - start
+        return target
+
+    def __match_target(self, metric, target, stats=None):
+        '''
+        returns the target for given metric according to the target config,
+        or None if the metric doesn't meet its criteria
+        '''
+        # metric must not match any of the no_match objects
+        for no_match_object in target.get('no_match_object', []):
+            no_match = no_match_object.search(metric)
+            if stats is not None:
+                stats['attempts'] += 1
+            if no_match is not None:
+                if stats is not None:
+                    stats['no_match'] += 1
+                return None
+        # first match object that creates a match is a winner
+        for match_object in target['match_object']:
+            match = match_object.search(metric)
+            if stats is not None:
+                stats['attempts'] += 1
+            if match is not None:
+                if stats is not None:
+                    stats['matches'] += 1
+                target = self.__create_target(match, target)
+                target = self.__sanitize_target(target)
+                target = self.__configure_target(target)
+                del target['config']  # not needed beyond this point
+                return target
+        return None
 
     def classname_to_tag(self):
         '''
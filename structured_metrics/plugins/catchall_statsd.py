@@ -40,8 +40,8 @@ class CatchallStatsdPlugin(Plugin):
         },
         {
             # TODO: for some reason the 'count' at the end makes this regex quite slow
-            # you can see this in StructuredMetrics.list_targets if you print
-            # something for every metric. timers will be very slowly. if you
+            # you can see this with `update_metrics.py --profile`.
+            # timers will be very slowly. if you
             # make it (?P<type>[^\.]+) it becomes fast again, but we need to
             # match on only the ones ending on count :(
             'match': '^stats\.timers\.(?P<n1>[^\.]+)\.?(?P<n2>[^\.]*)\.?(?P<n3>[^\.]*)\.?(?P<n4>[^\.]*)\.?(?P<n5>[^\.]*)\.?(?P<n6>[^\.]*)\.?(?P<n7>[^\.]*)\.count$',
@@ -3,11 +3,20 @@ import os
 import sys
 import urllib2
 import logging
+from optparse import OptionParser
 
 import config
 from backend import Backend, MetricsError
 import structured_metrics
 
+parser = OptionParser()
+parser.add_option('--delta', action='store_true', default=False,
+                  help="only index/delete the metrics that were added/removed since the previous update. "
+                       "do a full update after changing plugins")
+parser.add_option('--profile', action='store_true', default=False,
+                  help="print how much time every plugin and target config takes to classify the metrics")
+(options, args) = parser.parse_args()
+
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 logger = logging.getLogger('update_metrics')
@@ -24,15 +33,19 @@ if config.log_file:
 try:
     backend = Backend(config, logger)
     s_metrics = structured_metrics.StructuredMetrics(config)
+    s_metrics.profiling = options.profile
     errors = s_metrics.load_plugins()
     if len(errors) > 0:
         logger.warn('errors encountered while loading plugins:')
         for e in errors:
             print '\t%s' % e
     logger.info("fetching/saving metrics from graphite...")
-    backend.download_metrics_json()
+    if not backend.download_metrics_json():
+        logger.info("metrics index unchanged since the last download")
     logger.info("generating structured metrics data...")
-    backend.update_data(s_metrics)
+    backend.update_data(s_metrics, delta=options.delta)
+    if options.profile:
+        print s_metrics.get_profile_report()
     logger.info("success!")
 except Exception, e:
     logger.error("sorry, something went wrong: %s", e)